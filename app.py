@@ -1,10 +1,26 @@
+import base64
+import binascii
+import functools
+import hashlib
+import hmac
+import json
 import os
+import random
+import re
+import threading
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
 from dotenv import load_dotenv
 import google.generativeai as genai
-from github import Github, Auth
+import httpx
+from github import Github, Auth, GithubException, InputGitTreeElement
 import time
 import requests
+from requests.adapters import HTTPAdapter
+import llm_cache
+import task_store
 
 load_dotenv()
 
@@ -13,52 +29,338 @@ app = Flask(__name__)
 MY_APP_SECRET = os.environ.get('APP_SECRET')
 GITHUB_PAT = os.environ.get('GITHUB_PAT')
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+# Public URL of /api/webhook/github; deployments fall back to polling without it.
+GITHUB_WEBHOOK_URL = os.environ.get('GITHUB_WEBHOOK_URL')
+GITHUB_WEBHOOK_SECRET = os.environ.get('GITHUB_WEBHOOK_SECRET')
+WEBHOOK_WAIT_SECONDS = int(os.environ.get('WEBHOOK_WAIT_SECONDS', 120))
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 20))
+# Below this many remaining GitHub API calls, polling slows down until the reset.
+RATE_LIMIT_LOW_WATERMARK = 100
 
 genai.configure(api_key=GEMINI_API_KEY)
 
-def generate_app_code(brief, checks, attachments):
-    """Generates application code using the Gemini API for a new app."""
-    model = genai.GenerativeModel('gemini-2.5-pro')
-
-    attachments_prompt_part = ""
-    if attachments:
-        attachment_details = []
-        for att in attachments:
-            attachment_details.append(f"- {att['name']}: provided as a data URI '{att['url']}'")
-        attachments_str = "\n".join(attachment_details)
-        attachments_prompt_part = f"""
+def make_session():
+    """Creates a requests session that keeps a pool of connections alive."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Shared clients so TLS connections are reused across calls and threads.
+GH = Github(auth=Auth.Token(GITHUB_PAT) if GITHUB_PAT else None, pool_size=HTTP_POOL_SIZE)
+# Raw REST/GraphQL calls multiplex over HTTP/2 instead of opening a connection per call.
+GITHUB_CLIENT = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+    headers={
+        "Authorization": f"token {GITHUB_PAT}",
+        "Accept": "application/vnd.github.v3+json"
+    },
+    timeout=30,
+)
+# Used for evaluator callbacks, so it must never carry the GitHub token.
+HTTP_SESSION = make_session()
+
+@functools.lru_cache(maxsize=None)
+def get_user_login():
+    """Returns the login of the PAT's user, fetched once and then cached."""
+    return GH.get_user().login
+
+GEMINI_MODEL = 'gemini-2.5-pro'
+EMBEDDING_MODEL = 'models/text-embedding-004'
+# Deterministic sampling, so identical prompts can be served from the LLM cache.
+GENERATION_CONFIG = {"temperature": 0}
+# Round 2 returns both files as structured JSON, mapped to repo paths below.
+REVISED_FILES = {"index_html": "index.html", "readme_md": "README.md"}
+REVISE_GENERATION_CONFIG = {
+    **GENERATION_CONFIG,
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "object",
+        "properties": {field: {"type": "string"} for field in REVISED_FILES},
+        "required": list(REVISED_FILES),
+    },
+}
+
+# Prompt templates are compiled once and keep their invariant text first, so
+# sibling requests share the longest possible prefix for Gemini's implicit cache.
+BUILD_SYSTEM_INSTRUCTION = """You are an expert front-end web developer.
+Your task is to create a single, self-contained 'index.html' file.
+This file must include all necessary HTML, inline CSS, and inline JavaScript."""
+BUILD_PROMPT_TEMPLATE = """
+Return only the complete HTML code.
+The generated application will be tested against the checks listed at the end; ensure your code passes all of them.
+
+Here is the application brief: "{brief}"
+{attachments}
+Checks: {checks}
+"""
+BUILD_ATTACHMENTS_TEMPLATE = """
 The application must use the following data attachments:
-{attachments_str}
-Your JavaScript code must be able to fetch and process these data URIs.
+{attachments}
+Your JavaScript code must load these with fetch() from the given URLs; do not inline their contents.
 """
 
-    prompt = f"""
-    You are an expert front-end web developer.
-    Your task is to create a single, self-contained 'index.html' file.
-    This file must include all necessary HTML, inline CSS, and inline JavaScript.
+REVISE_SYSTEM_INSTRUCTION = """You are an expert software developer modifying a project.
+You will be given the current files, followed by a change request.
+Large inline data in the files has been replaced by placeholders such as __DATA_URI_0__;
+keep each placeholder exactly as written wherever that data is still needed.
+Your response must contain the complete, new versions of BOTH files:
+"index_html" holds the new index.html and "readme_md" the new README.md."""
+REVISE_CONTEXT_TEMPLATE = """
+Here are the current files:
+
+--- FILE: index.html ---
+{index_html}
+
+--- FILE: README.md ---
+{readme}
+
+--- END OF FILES ---
+"""
+REVISE_PROMPT_TEMPLATE = """
+{attachments}
+Now, update the files to implement the following request: "{brief}"
+The updated code must pass these checks: {checks}
+"""
+REVISE_ATTACHMENTS_TEMPLATE = """
+The project uses data from these attachments:
+{attachments}
+The content for these is embedded or fetched in the existing code. Ensure the updated code continues to use this data correctly.
+"""
+# Attachments are committed as files under assets/ and described to the LLM by
+# URL and a short text preview, instead of pasting data URIs into prompts.
+ATTACHMENT_PREVIEW_CHARS = 300
+DATA_URI_PATTERN = re.compile(r"data:[^,\s\"'`\\]*,[^\s\"'`\\)]+")
+INLINE_DATA_MIN_LENGTH = 2048
+
+# Build/revise pipelines run here so the HTTP request can return immediately.
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get('TASK_WORKERS', 8)))
+# Finished tasks stay queryable for this long before being dropped from the registry.
+TASK_STATUS_TTL_SECONDS = int(os.environ.get('TASK_STATUS_TTL', 3600))
+tasks = {}
+# Idempotency keys of submissions currently queued or running, mapped to their task id.
+active_submissions = {}
+tasks_lock = threading.Lock()
+# Evaluator notifications retry here without holding a pipeline worker.
+notify_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('NOTIFY_WORKERS', 4)))
+# Independent GitHub/HTTP calls inside a pipeline are fanned out here.
+io_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('IO_WORKERS', 16)))
+
+def prune_finished_tasks():
+    """Drops finished tasks older than the TTL; callers must hold tasks_lock."""
+    cutoff = time.monotonic() - TASK_STATUS_TTL_SECONDS
+    expired = [
+        task_id for task_id, task in tasks.items()
+        if "finished_at" in task and task["finished_at"] < cutoff
+    ]
+    for task_id in expired:
+        del tasks[task_id]
+
+def run_concurrently(*calls):
+    """Runs zero-argument callables on the I/O pool and returns their results in order."""
+    futures = [io_pool.submit(call) for call in calls]
+    return [future.result() for future in futures]
+
+# Deployment waiters keyed by repo name, resolved by GitHub webhook deliveries.
+deployment_waiters = {}
+deployment_waiters_lock = threading.Lock()
+
+def webhooks_enabled():
+    return bool(GITHUB_WEBHOOK_URL and GITHUB_WEBHOOK_SECRET)
+
+def embed_text(text):
+    """Returns an embedding for text, or None if the embedding call fails."""
+    try:
+        return genai.embed_content(model=EMBEDDING_MODEL, content=text)["embedding"]
+    except Exception as e:
+        print(f"Failed to embed text for the semantic cache: {e}")
+        return None
+
+def generate_content_cached(prompt, system_instruction, context=None, generation_config=GENERATION_CONFIG,
+                            semantic_text=None, semantic_context=None, validate=bool):
+    """Calls Gemini for a prompt, serving repeats from the LLM cache.
 
-    Here is the application brief: "{brief}"
-    {attachments_prompt_part}
-    The generated application will be tested against these checks: {checks}
-    Ensure your code passes all of them. Return only the complete HTML code.
+    The context, if any, is sent ahead of the prompt. When semantic_text is
+    given, near-duplicate requests sharing the same semantic_context are also
+    served from the semantic cache. Responses are only cached once Gemini
+    finished normally and validate accepts the text, so a retry never gets a
+    truncated or empty response back.
     """
+    cache_key = llm_cache.make_key(
+        model=GEMINI_MODEL, config=generation_config,
+        system_instruction=system_instruction, context=context, prompt=prompt
+    )
+    cached_response = llm_cache.get(cache_key)
+    if cached_response is not None:
+        print("Using cached Gemini response.")
+        return cached_response
+
+    embedding = None
+    if semantic_text:
+        context_key = llm_cache.make_key(model=GEMINI_MODEL, config=generation_config, context=semantic_context)
+        embedding = embed_text(semantic_text)
+        if embedding:
+            similar_response = llm_cache.find_similar(context_key, embedding)
+            if similar_response is not None:
+                llm_cache.put(cache_key, similar_response)
+                return similar_response
+
+    model = genai.GenerativeModel(
+        GEMINI_MODEL, system_instruction=system_instruction, generation_config=generation_config
+    )
+    response = model.generate_content([context, prompt] if context else prompt)
+    finished = response.candidates and response.candidates[0].finish_reason == genai.protos.Candidate.FinishReason.STOP
+    if not finished or not validate(response.text):
+        print("Gemini response is incomplete or invalid, not caching it.")
+        return response.text
+    llm_cache.put(cache_key, response.text)
+    if embedding:
+        llm_cache.put_similar(context_key, embedding, response.text)
+    return response.text
+
+def asset_paths(attachments):
+    """Returns the repo path each attachment is committed to, or None if its name is unusable.
+
+    Names that collide get a numeric suffix, so no attachment overwrites another.
+    """
+    paths, taken = [], set()
+    for att in attachments:
+        name = os.path.basename(att.get('name') or '')
+        if name in ('', '.', '..'):
+            paths.append(None)
+            continue
+        stem, extension = os.path.splitext(name)
+        path, suffix = f"assets/{name}", 2
+        while path in taken:
+            path, suffix = f"assets/{stem}-{suffix}{extension}", suffix + 1
+        taken.add(path)
+        paths.append(path)
+    return paths
+
+def decode_attachments(attachments):
+    """Decodes data URI attachments into asset files keyed by repo path."""
+    assets = {}
+    for att, path in zip(attachments, asset_paths(attachments)):
+        if path is None:
+            # Left out of the assets, so the prompt falls back to the raw URL.
+            print(f"Warning: Skipping attachment with unusable name {att.get('name')!r}.")
+            continue
+        if path != f"assets/{att['name']}":
+            print(f"Warning: Committing attachment {att['name']} as {path}.")
+        header, separator, payload = att.get('url', '').partition(',')
+        if not header.startswith('data:') or not separator:
+            continue
+        try:
+            if header.endswith(';base64'):
+                content = base64.b64decode(payload)
+            else:
+                content = urllib.parse.unquote_to_bytes(payload)
+        except (binascii.Error, ValueError) as e:
+            # Left out of the assets, so the prompt falls back to the raw URL.
+            print(f"Warning: Could not decode attachment {att['name']}: {e}")
+            continue
+        assets[path] = content
+    return assets
+
+def describe_attachments(attachments, assets):
+    """Lists attachments for a prompt by URL, with a short preview of text assets."""
+    lines = []
+    for att, path in zip(attachments, asset_paths(attachments)):
+        if path not in assets:
+            lines.append(f"- {att['name']}: available at '{att['url']}'")
+            continue
+        lines.append(f"- {att['name']}: available at './{path}'")
+        try:
+            text = assets[path].decode("utf-8")
+        except UnicodeDecodeError:
+            continue
+        lines.append(f"  First {ATTACHMENT_PREVIEW_CHARS} characters:\n{text[:ATTACHMENT_PREVIEW_CHARS]}")
+    return "\n".join(lines)
+
+def strip_data_uris(text):
+    """Replaces large inline data URIs with placeholders, returning the text and the removed URIs."""
+    data_uris = []
+    def replace(match):
+        if len(match.group(0)) < INLINE_DATA_MIN_LENGTH:
+            return match.group(0)
+        data_uris.append(match.group(0))
+        return f"__DATA_URI_{len(data_uris) - 1}__"
+    return DATA_URI_PATTERN.sub(replace, text), data_uris
+
+def restore_data_uris(text, data_uris):
+    """Puts data URIs removed by strip_data_uris back in place of their placeholders."""
+    for i, data_uri in enumerate(data_uris):
+        text = text.replace(f"__DATA_URI_{i}__", data_uri)
+    return text
+
+def extract_html(response_text):
+    """Strips the Markdown code fences Gemini tends to wrap generated HTML in."""
+    return response_text.strip().replace("```html", "").replace("```", "")
+
+def is_complete_revision(response_text):
+    """Checks that a Round 2 response is a JSON object with non-empty content for every file."""
+    try:
+        files = json.loads(response_text)
+    except ValueError:
+        return False
+    return isinstance(files, dict) and all(
+        isinstance(files.get(field), str) and files[field].strip() for field in REVISED_FILES
+    )
+
+def generate_app_code(brief, checks, attachments, assets):
+    """Generates application code using the Gemini API for a new app."""
+    attachments_prompt_part = ""
+    if attachments:
+        attachments_prompt_part = BUILD_ATTACHMENTS_TEMPLATE.format(
+            attachments=describe_attachments(attachments, assets)
+        )
+
+    prompt = BUILD_PROMPT_TEMPLATE.format(brief=brief, attachments=attachments_prompt_part, checks=checks)
 
     print("Generating code with Gemini...")
-    response = model.generate_content(prompt)
-    generated_code = response.text.strip().replace("```html", "").replace("```", "")
+    # Paraphrased briefs may reuse a response, but only with identical checks and attachments;
+    # those are matched exactly, so only the brief is embedded.
+    response_text = generate_content_cached(
+        prompt,
+        BUILD_SYSTEM_INSTRUCTION,
+        semantic_text=brief,
+        semantic_context={"checks": checks, "attachments": attachments},
+        validate=lambda text: extract_html(text).strip(),
+    )
+    generated_code = extract_html(response_text)
     print("Code generation complete.")
     return generated_code
 
 
-def create_and_deploy_repo(task_id, generated_html):
-    """Creates a GitHub repo, pushes code, and enables Pages."""
+def create_repo(task_id):
+    """Creates the GitHub repo for a task, reusing it if an earlier attempt already did.
+
+    Returns the repo and whether its deployment webhook is in place, or (None, False).
+    """
+    repo_name = f"llm-app-{task_id}"
     try:
-        auth = Auth.Token(GITHUB_PAT)
-        g = Github(auth=auth)
-        user = g.get_user()
-        repo_name = f"llm-app-{task_id}"
         print(f"Creating repository: {repo_name}")
-        repo = user.create_repo(repo_name, private=False)
+        try:
+            # auto_init gives the repo a main branch to build the first real commit on.
+            repo = GH.get_user().create_repo(repo_name, private=False, auto_init=True)
+        except GithubException as e:
+            if e.status != 422:
+                raise
+            print(f"Repository {repo_name} already exists, reusing it.")
+            repo = GH.get_repo(f"{get_user_login()}/{repo_name}")
+        has_webhook = register_deployment_webhook(repo, repo_name)
+        get_user_login()  # Warm the cache so deployment doesn't wait on GET /user.
+        return repo, has_webhook
+    except Exception as e:
+        print(f"An error occurred while creating repository {repo_name}: {e}")
+        return None, False
+
+def deploy_repo(repo, generated_html, assets, has_webhook):
+    """Pushes the generated app and its assets to a repo and enables Pages."""
+    try:
+        repo_name = repo.name
         license_content = '''MIT License
 
             Copyright (c) 2025 Anay Patil
@@ -81,50 +383,165 @@ def create_and_deploy_repo(task_id, generated_html):
             OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
             SOFTWARE.
         '''
-        repo.create_file("LICENSE", "feat: Add LICENSE", license_content, branch="main")
         readme_content = f"# {repo_name}\n\nThis project was auto-generated for the TDS Project."
-        repo.create_file("README.md", "feat: Add README", readme_content, branch="main")
-        repo.create_file("index.html", "feat: Add application code", generated_html, branch="main")
-        print("Enabling GitHub Pages via API...")
-        headers = {
-            "Authorization": f"token {GITHUB_PAT}",
-            "Accept": "application/vnd.github.v3+json"
-        }
-        payload = {"source": {"branch": "main", "path": "/"}}
-        pages_endpoint = f"https://api.github.com/repos/{user.login}/{repo.name}/pages"
-        response = requests.post(pages_endpoint, headers=headers, json=payload)
-
-        if response.status_code != 201:
-            print(f"Failed to enable GitHub Pages. Status: {response.status_code}, Response: {response.text}")
-            return None
-
-        pages_url = response.json().get("html_url")
-        print(f"GitHub Pages enabled. URL will be: {pages_url}")
-        
-        deployment_successful = wait_for_github_pages_deployment(repo)
+        waiter = expect_deployment(repo_name) if has_webhook else None
+        # The Pages URL is deterministic, so Pages is enabled alongside the commit
+        # instead of on the critical path; the deployment wait is matched by commit sha.
+        pages_url = f"https://{get_user_login()}.github.io/{repo_name}/"
+        pages_future = io_pool.submit(enable_github_pages, repo_name)
+        try:
+            commit_sha = commit_files(repo, {
+                "LICENSE": license_content,
+                "README.md": readme_content,
+                "index.html": generated_html,
+                # Pages runs Jekyll on branch builds, which drops assets named with a leading _ or .
+                ".nojekyll": "",
+                **assets,
+            }, "feat: Add application code")
+            track_deployment(waiter, commit_sha)
+            print(f"GitHub Pages URL will be: {pages_url}")
+            pages_future.result()
+
+            deployment_successful = wait_for_github_pages_deployment(repo, commit_sha, waiter)
+        finally:
+            discard_deployment_waiter(waiter)
         if not deployment_successful:
             print("Aborting due to deployment failure or timeout.")
             return None
 
-        commit_sha = repo.get_branch("main").commit.sha
-
         return {"repo_url": repo.html_url, "pages_url": pages_url, "commit_sha": commit_sha}
     except Exception as e:
         print(f"An error occurred during GitHub operations: {e}")
         return None
 
-def wait_for_github_pages_deployment(repo):
-    """Polls the GitHub API to check for a successful Pages deployment."""
+def enable_github_pages(repo_name):
+    """Enables Pages on main; errors are only logged, as the deployment wait is authoritative."""
+    print("Enabling GitHub Pages via API...")
+    payload = {"source": {"branch": "main", "path": "/"}}
+    pages_endpoint = f"https://api.github.com/repos/{get_user_login()}/{repo_name}/pages"
+    try:
+        response = GITHUB_CLIENT.post(pages_endpoint, json=payload)
+        if response.status_code != 201:
+            print(f"Failed to enable GitHub Pages. Status: {response.status_code}, Response: {response.text}")
+    except httpx.HTTPError as e:
+        print(f"Failed to enable GitHub Pages: {e}")
+
+def git_blob_sha(content):
+    """Returns the git blob SHA-1 of a file's text or bytes, as GitHub would compute it."""
+    data = content if isinstance(content, bytes) else content.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+def commit_files(repo, files, message, branch="main"):
+    """Commits several files to a branch as a single commit via the Git Data API."""
+    def get_head():
+        ref = repo.get_git_ref(f"heads/{branch}")
+        return ref, repo.get_git_commit(ref.object.sha)
+
+    def create_blob(content):
+        if isinstance(content, bytes):
+            return repo.create_git_blob(base64.b64encode(content).decode("ascii"), "base64")
+        return repo.create_git_blob(content, "utf-8")
+
+    blob_calls = [lambda content=content: create_blob(content) for content in files.values()]
+    (ref, parent), *blobs = run_concurrently(get_head, *blob_calls)
+
+    tree_elements = [
+        InputGitTreeElement(path, "100644", "blob", sha=blob.sha)
+        for path, blob in zip(files, blobs)
+    ]
+    tree = repo.create_git_tree(tree_elements, base_tree=parent.tree)
+    commit = repo.create_git_commit(message, tree, [parent])
+    ref.edit(sha=commit.sha)
+    return commit.sha
+
+def register_deployment_webhook(repo, repo_name):
+    """Subscribes the service to Pages build and workflow events for a repo.
+
+    Returns whether the repo has the webhook, so callers only wait on deliveries that can arrive.
+    """
+    if not webhooks_enabled():
+        return False
+    try:
+        repo.create_hook(
+            "web",
+            {"url": GITHUB_WEBHOOK_URL, "content_type": "json", "secret": GITHUB_WEBHOOK_SECRET},
+            events=["page_build", "workflow_run"],
+            active=True,
+        )
+        print(f"Registered deployment webhook for {repo_name}.")
+        return True
+    except GithubException as e:
+        if e.status == 422 and "already exists" in str(e.data):
+            return True
+        print(f"Failed to register webhook, falling back to polling: {e}")
+        return False
+    except Exception as e:
+        print(f"Failed to register webhook, falling back to polling: {e}")
+        return False
+
+def expect_deployment(repo_name):
+    """Registers a waiter for the next deployment result of a repo that has the webhook."""
+    waiter = {
+        "repo_name": repo_name, "event": threading.Event(), "success": None,
+        "commit_sha": None, "results": {}
+    }
+    with deployment_waiters_lock:
+        deployment_waiters[repo_name] = waiter
+    return waiter
+
+def track_deployment(waiter, commit_sha):
+    """Sets the commit a waiter is interested in, applying any result that already arrived."""
+    if not waiter:
+        return
+    with deployment_waiters_lock:
+        waiter["commit_sha"] = commit_sha
+        if commit_sha in waiter["results"] and not waiter["event"].is_set():
+            waiter["success"] = waiter["results"][commit_sha]
+            waiter["event"].set()
+
+def resolve_deployment(repo_name, commit_sha, success):
+    """Wakes up the pipeline waiting on the deployment of a repo's commit."""
+    with deployment_waiters_lock:
+        waiter = deployment_waiters.get(repo_name)
+        if not waiter or waiter["event"].is_set():
+            return
+        # Builds of other commits (e.g. the auto-init one) are recorded but don't wake the waiter.
+        waiter["results"][commit_sha] = success
+        if waiter["commit_sha"] == commit_sha:
+            waiter["success"] = success
+            waiter["event"].set()
+
+def discard_deployment_waiter(waiter):
+    """Unregisters a waiter once its pipeline is done with it, whether or not it was resolved."""
+    if not waiter:
+        return
+    with deployment_waiters_lock:
+        if deployment_waiters.get(waiter["repo_name"]) is waiter:
+            del deployment_waiters[waiter["repo_name"]]
+
+def backoff_delay(attempt, base, cap, factor=1.5):
+    """Returns an exponential backoff delay for an attempt, capped and with up to 1s of jitter."""
+    return min(cap, base * factor ** attempt) + random.uniform(0, 1)
+
+def wait_for_github_pages_deployment(repo, commit_sha, waiter=None):
+    """Waits for a Pages deployment via webhook, polling the GitHub API as a fallback."""
     print("Waiting for GitHub Pages deployment to complete...")
-    time.sleep(5) 
-    
+    if waiter:
+        if waiter["event"].wait(timeout=WEBHOOK_WAIT_SECONDS):
+            if waiter["success"]:
+                print("✅ Deployment successful!")
+            else:
+                print("❌ Deployment failed according to webhook.")
+            return waiter["success"]
+        print("No webhook delivery received, falling back to polling.")
+
     timeout_seconds = 300 
-    poll_interval_seconds = 10
-    elapsed_time = 0
+    deadline = time.monotonic() + timeout_seconds
+    attempt = 0
 
-    while elapsed_time < timeout_seconds:
+    while time.monotonic() < deadline:
         try:
-            workflow_runs = repo.get_workflow_runs()
+            workflow_runs = repo.get_workflow_runs(head_sha=commit_sha)
             if workflow_runs.totalCount > 0:
                 latest_run = workflow_runs[0]
                 
@@ -136,27 +553,41 @@ def wait_for_github_pages_deployment(repo):
                     else:
                         print(f"❌ Deployment failed with conclusion: {latest_run.conclusion}")
                         return False
-            
-            time.sleep(poll_interval_seconds)
-            elapsed_time += poll_interval_seconds
+                interval = backoff_delay(attempt, base=2, cap=20)
+                attempt += 1
+            else:
+                # The run usually appears within seconds; re-check quickly until it does.
+                interval = 3
+
+            remaining, _ = GH.rate_limiting
+            if remaining < RATE_LIMIT_LOW_WATERMARK:
+                seconds_until_reset = GH.rate_limiting_resettime - time.time()
+                print(f"  - Only {remaining} API calls left, slowing down polling.")
+                interval = max(interval, min(60, seconds_until_reset))
+            time.sleep(max(0, min(interval, deadline - time.monotonic())))
             
         except Exception as e:
             print(f"An error occurred while checking workflow status: {e}")
             return False
 
-    print("❌ Deployment check timed out after 2 minutes.")
+    print(f"❌ Deployment check timed out after {timeout_seconds} seconds.")
     return False
 
 def process_build_request(data):
     """Orchestrates the build and deployment process for Round 1."""
     print("Build task started!")
-    generated_code = generate_app_code(data.get('brief'), data.get('checks'), data.get('attachments', []))
-    if not generated_code:
-        return
+    # Repo setup doesn't depend on the generated code, so it runs while Gemini works.
+    repo_future = io_pool.submit(create_repo, data.get('task'))
+    attachments = data.get('attachments', [])
+    assets = decode_attachments(attachments)
+    generated_code = generate_app_code(data.get('brief'), data.get('checks'), attachments, assets)
+    repo, has_webhook = repo_future.result()
+    if not generated_code or not repo:
+        return None
 
-    github_details = create_and_deploy_repo(data.get('task'), generated_code)
+    github_details = deploy_repo(repo, generated_code, assets, has_webhook)
     if not github_details:
-        return
+        return None
     notification_payload = {
         "email": data.get('email'),
         "task": data.get('task'),
@@ -166,119 +597,135 @@ def process_build_request(data):
         "commit_sha": github_details['commit_sha'],
         "pages_url": github_details['pages_url']
     }
-    notify_evaluator(data.get('evaluation_url'), notification_payload)
+    send_notification(data.get('evaluation_url'), notification_payload)
     print("Build task finished.")
+    return notification_payload
 
 
 # --- Round 2: Revise Logic ---
 
+EXISTING_FILES_QUERY = """
+query($name: String!) {
+  viewer {
+    login
+    repository(name: $name) {
+      url
+      ref(qualifiedName: "refs/heads/main") { target { oid } }
+      index: object(expression: "main:index.html") { ... on Blob { oid text isTruncated } }
+      readme: object(expression: "main:README.md") { ... on Blob { oid text isTruncated } }
+      assets: object(expression: "main:assets") { ... on Tree { entries { name oid } } }
+    }
+  }
+}
+"""
+
 def get_existing_repo_details(task_id):
-    """Finds a repo and fetches the content of index.html and README.md."""
+    """Finds a repo and fetches the content of index.html and README.md in one GraphQL query."""
+    repo_name = f"llm-app-{task_id}"
     try:
-        auth = Auth.Token(GITHUB_PAT)
-        g = Github(auth=auth)
-        user = g.get_user()
-        repo_name = f"llm-app-{task_id}"
-        repo = user.get_repo(repo_name)
-        index_file = repo.get_contents("index.html")
-        readme_file = repo.get_contents("README.md")
-        
+        response = GITHUB_CLIENT.post(
+            "https://api.github.com/graphql",
+            json={"query": EXISTING_FILES_QUERY, "variables": {"name": repo_name}},
+        )
+        response.raise_for_status()
+        result = response.json()
+        if result.get("errors"):
+            raise RuntimeError(result["errors"])
+
+        viewer = result["data"]["viewer"]
+        repository = viewer["repository"]
+        if not repository:
+            raise RuntimeError("repository not found")
+        for field, filename in (("index", "index.html"), ("readme", "README.md")):
+            blob = repository[field]
+            if not blob or blob["text"] is None or blob["isTruncated"]:
+                raise RuntimeError(f"could not read {filename}")
+
         existing_code = {
-            "index.html": index_file.decoded_content.decode("utf-8"),
-            "README.md": readme_file.decoded_content.decode("utf-8")
+            "index.html": repository["index"]["text"],
+            "README.md": repository["readme"]["text"]
+        }
+        # Blob and head SHAs let the update skip unchanged files without re-fetching them.
+        file_shas = {
+            "index.html": repository["index"]["oid"],
+            "README.md": repository["readme"]["oid"]
+        }
+        for entry in (repository["assets"] or {}).get("entries", []):
+            file_shas[f"assets/{entry['name']}"] = entry["oid"]
+        # Lazy, so no request is made until the repo is actually written to.
+        repo = GH.get_repo(f"{viewer['login']}/{repo_name}", lazy=True)
+
+        return {
+            "repo": repo, "repo_name": repo_name, "repo_url": repository["url"],
+            "login": viewer["login"], "existing_code": existing_code,
+            "file_shas": file_shas, "head_sha": repository["ref"]["target"]["oid"]
         }
-        
-        return {"repo": repo, "user": user, "existing_code": existing_code}
     except Exception as e:
         print(f"Error fetching repo files for {repo_name}: {e}")
         return None
 
 
-def generate_updated_code(brief, checks, existing_code, attachments):
+def generate_updated_code(brief, checks, existing_code, attachments, assets):
     """Generates updated code for both index.html and README.md."""
-    model = genai.GenerativeModel('gemini-2.5-pro')
-
     attachments_prompt_part = ""
     if attachments:
-        attachment_details = "\n".join([f"- {att['name']}" for att in attachments])
-        attachments_prompt_part = f"""
-        The project uses data from these attachments: {attachment_details}
-        The content for these is embedded or fetched in the existing code. Ensure the updated code continues to use this data correctly.
-        """
-
-    prompt = f"""
-    You are an expert software developer modifying a project.
-    Here are the current files:
-
-    --- FILE: index.html ---
-    {existing_code['index.html']}
-
-    --- FILE: README.md ---
-    {existing_code['README.md']}
-
-    --- END OF FILES ---
-
-    {attachments_prompt_part}
-
-    Now, update the files to implement the following request: "{brief}"
-    The updated code must pass these checks: {checks}
-
-    Your response must contain the complete, new versions of BOTH files.
-    Structure your response exactly like this, with no other text or explanations:
-
-    --- FILE: index.html ---
-    (new html code here)
-
-    --- FILE: README.md ---
-    (new readme content here)
-    """
+        attachments_prompt_part = REVISE_ATTACHMENTS_TEMPLATE.format(
+            attachments=describe_attachments(attachments, assets)
+        )
+
+    # The current files are the large, stable part of the request and go in the context,
+    # minus inline data that the LLM only needs to carry over unchanged.
+    index_html, data_uris = strip_data_uris(existing_code['index.html'])
+    context = REVISE_CONTEXT_TEMPLATE.format(index_html=index_html, readme=existing_code['README.md'])
+    prompt = REVISE_PROMPT_TEMPLATE.format(attachments=attachments_prompt_part, brief=brief, checks=checks)
     
     print("Generating updated code for all files with Gemini...")
-    response = model.generate_content(prompt)
+    response_text = generate_content_cached(
+        prompt, REVISE_SYSTEM_INSTRUCTION, context=context, generation_config=REVISE_GENERATION_CONFIG,
+        validate=is_complete_revision,
+    )
     print("Code update generation complete.")
-    return response.text
+    return restore_data_uris(response_text, data_uris)
 
-def update_repo_files(repo, llm_response):
-    """Parses the LLM response, updates files, and waits for redeployment."""
+def update_repo_files(repo_details, llm_response, assets, has_webhook):
+    """Parses the LLM response, updates files and assets, and waits for redeployment."""
+    repo, repo_name = repo_details['repo'], repo_details['repo_name']
     try:
         print("Parsing LLM response and updating repository files...")
-        files_raw = llm_response.split("--- FILE: ")
-        
-        new_commit_sha = ""
-        for file_raw in files_raw:
-            if not file_raw.strip():
-                continue
-            
-            print("Processing file block...")
-            
-            parts = file_raw.split("\n", 1)
-            if len(parts) < 2:
-                print("Warning: Skipping malformed file block.")
-                continue
-            
-            filename = parts[0].split("---")[0].strip()
-            content = parts[1].strip().replace("```html", "").replace("```", "")
+        files = json.loads(llm_response)
 
-            if filename in ["index.html", "README.md"]:
+        updated_files = {}
+        for field, filename in REVISED_FILES.items():
+            content = files.get(field)
+            if isinstance(content, str) and content.strip():
                 print(f"Found valid file: {filename}")
-                original_file = repo.get_contents(filename)
-                
-                result = repo.update_file(
-                    path=original_file.path,
-                    message=f"feat: Update {filename} based on revision",
-                    content=content,
-                    sha=original_file.sha
-                )
-                new_commit_sha = result['commit'].sha
-                print(f"Successfully updated {filename}. New commit: {new_commit_sha}")
+                updated_files[filename] = content
             else:
-                print(f"Warning: Skipping unexpected file found in LLM response: {filename}")
+                print(f"Warning: LLM response is missing content for {filename}.")
 
-        if not new_commit_sha:
+        if not updated_files:
             print("Error: No valid files were updated.")
             return None
-            
-        deployment_successful = wait_for_github_pages_deployment(repo)
+        updated_files.update(assets)
+
+        # Files and assets matching the blob SHAs fetched with the originals are unchanged and skipped.
+        changed_files = {
+            filename: content for filename, content in updated_files.items()
+            if git_blob_sha(content) != repo_details['file_shas'].get(filename)
+        }
+        if not changed_files:
+            print("LLM returned unchanged files; the current commit is already deployed.")
+            return repo_details['head_sha']
+
+        waiter = expect_deployment(repo_name) if has_webhook else None
+        try:
+            new_commit_sha = commit_files(repo, changed_files, "feat: Update application based on revision")
+            track_deployment(waiter, new_commit_sha)
+            print(f"Successfully updated {', '.join(changed_files)}. New commit: {new_commit_sha}")
+
+            deployment_successful = wait_for_github_pages_deployment(repo, new_commit_sha, waiter)
+        finally:
+            discard_deployment_waiter(waiter)
         if not deployment_successful:
             print("Aborting due to redeployment failure or timeout.")
             return None
@@ -295,39 +742,89 @@ def process_revise_request(data):
     attachments = data.get('attachments', [])
     
     repo_details = get_existing_repo_details(task_id)
-    if not repo_details: return
-    llm_response = generate_updated_code(brief, checks, repo_details['existing_code'], attachments)
-    if not llm_response: return
-    commit_sha = update_repo_files(repo_details['repo'], llm_response)
-    if not commit_sha: return
+    if not repo_details: return None
+    # Repos created before webhooks were configured get the hook now, while Gemini works.
+    webhook_future = io_pool.submit(register_deployment_webhook, repo_details['repo'], repo_details['repo_name'])
+    assets = decode_attachments(attachments)
+    llm_response = generate_updated_code(brief, checks, repo_details['existing_code'], attachments, assets)
+    has_webhook = webhook_future.result()
+    if not llm_response: return None
+    commit_sha = update_repo_files(repo_details, llm_response, assets, has_webhook)
+    if not commit_sha: return None
     
     notification_payload = {
         "email": data.get('email'), "task": task_id, "round": 2,
-        "nonce": data.get('nonce'), "repo_url": repo_details['repo'].html_url,
-        "commit_sha": commit_sha, "pages_url": f"https://{repo_details['user'].login}.github.io/{repo_details['repo'].name}/"
+        "nonce": data.get('nonce'), "repo_url": repo_details['repo_url'],
+        "commit_sha": commit_sha, "pages_url": f"https://{repo_details['login']}.github.io/{repo_details['repo_name']}/"
     }
-    notify_evaluator(data.get('evaluation_url'), notification_payload)
+    send_notification(data.get('evaluation_url'), notification_payload)
     print("Revision task finished.")
+    return notification_payload
+
+def send_notification(evaluation_url, payload):
+    """Notifies the evaluator in the background, dead-lettering the payload if all retries fail."""
+    def deliver():
+        try:
+            delivered = notify_evaluator(evaluation_url, payload)
+        except Exception as e:
+            print(f"Notification crashed with exception: {e}")
+            delivered = False
+        if not delivered:
+            task_store.add_dead_letter(evaluation_url, payload)
+
+    notify_pool.submit(deliver)
 
 def notify_evaluator(evaluation_url, payload):
     """Sends a POST request to the evaluation URL with retry logic."""
     max_retries, delay = 5, 1
     for i in range(max_retries):
+        retry_after = None
         try:
             print(f"Sending notification to {evaluation_url}...")
-            response = requests.post(evaluation_url, json=payload, timeout=10)
+            response = HTTP_SESSION.post(evaluation_url, json=payload, timeout=10)
             if response.status_code == 200:
                 print("Notification successful.")
                 return True
             print(f"Attempt {i + 1} failed with status {response.status_code}.")
+            retry_after = response.headers.get("Retry-After")
         except requests.exceptions.RequestException as e:
             print(f"Attempt {i + 1} failed with an exception: {e}")
         
-        time.sleep(delay)
-        delay *= 2
+        if i == max_retries - 1:
+            break
+        if retry_after and retry_after.isdigit():
+            time.sleep(min(int(retry_after), 60))
+        else:
+            time.sleep(delay + random.uniform(0, delay * 0.1))
+        delay = min(delay * 2, 30)
     print("Notification failed after all retries.")
     return False
 
+def run_task(task_id, idempotency_key, process, data):
+    """Runs a pipeline in the background and reports failures to the evaluator."""
+    with tasks_lock:
+        tasks[task_id]["status"] = "running"
+    try:
+        payload = process(data)
+        error = None if payload else "Pipeline did not complete."
+    except Exception as e:
+        print(f"Task {task_id} crashed with exception: {e}")
+        payload, error = None, str(e)
+
+    if not error:
+        task_store.save_result(idempotency_key, payload)
+    with tasks_lock:
+        tasks[task_id]["status"] = "failed" if error else "completed"
+        tasks[task_id]["error"] = error
+        tasks[task_id]["finished_at"] = time.monotonic()
+        active_submissions.pop(idempotency_key, None)
+    if error:
+        failure_payload = {
+            "email": data.get('email'), "task": data.get('task'), "round": data.get('round'),
+            "nonce": data.get('nonce'), "status": "failed", "error": error
+        }
+        send_notification(data.get('evaluation_url'), failure_payload)
+
 @app.route('/api/project', methods=['POST'])
 def handle_project_request():
     """Main endpoint to handle both build and revise requests."""
@@ -336,11 +833,69 @@ def handle_project_request():
         return jsonify({"error": "Invalid or missing secret"}), 403
 
     if data.get('round') == 2:
-        process_revise_request(data)
+        process = process_revise_request
     elif data.get('round') == 1:
-        process_build_request(data)
-
-    return jsonify({"status": "Request processed successfully."}), 200
+        process = process_build_request
+    else:
+        return jsonify({"error": "Unsupported round"}), 400
+
+    # Retried submissions are answered from the stored result or joined to the running task.
+    # The in-flight check comes first under the lock: run_task stores the result
+    # before it drops the in-flight entry, so a finished task is always found.
+    idempotency_key = task_store.idempotency_key(data)
+    with tasks_lock:
+        prune_finished_tasks()
+        task_id = active_submissions.get(idempotency_key)
+        if task_id:
+            return jsonify({"status": "accepted", "task_id": task_id}), 202
+        previous_payload = task_store.get_result(idempotency_key)
+        if not previous_payload:
+            task_id = uuid.uuid4().hex
+            tasks[task_id] = {"status": "queued", "task": data.get('task'), "round": data.get('round'), "error": None}
+            active_submissions[idempotency_key] = task_id
+    if previous_payload:
+        send_notification(data.get('evaluation_url'), previous_payload)
+        return jsonify({"status": "completed"}), 200
+    executor.submit(run_task, task_id, idempotency_key, process, data)
+
+    return jsonify({"status": "accepted", "task_id": task_id}), 202
+
+@app.route('/api/webhook/github', methods=['POST'])
+def handle_github_webhook():
+    """Receives page_build and workflow_run events to unblock deployment waits."""
+    if not GITHUB_WEBHOOK_SECRET:
+        return jsonify({"error": "Webhooks are not configured"}), 404
+    expected = "sha256=" + hmac.new(
+        GITHUB_WEBHOOK_SECRET.encode("utf-8"), request.get_data(), hashlib.sha256
+    ).hexdigest()
+    # Compared as bytes, since compare_digest rejects non-ASCII str headers with a TypeError.
+    signature = request.headers.get('X-Hub-Signature-256', '').encode("utf-8")
+    if not hmac.compare_digest(expected.encode("utf-8"), signature):
+        return jsonify({"error": "Invalid signature"}), 403
+
+    event = request.headers.get('X-GitHub-Event')
+    payload = request.get_json(silent=True) or {}
+    repo_name = payload.get('repository', {}).get('name')
+
+    if event == 'workflow_run' and payload.get('action') == 'completed':
+        run = payload['workflow_run']
+        resolve_deployment(repo_name, run.get('head_sha'), run.get('conclusion') == 'success')
+    elif event == 'page_build' and payload.get('build', {}).get('status') in ('built', 'errored'):
+        build = payload['build']
+        resolve_deployment(repo_name, build.get('commit'), build['status'] == 'built')
+
+    return jsonify({"status": "ok"}), 200
+
+@app.route('/api/tasks/<task_id>', methods=['GET'])
+def get_task_status(task_id):
+    """Reports the status of a background build or revise task."""
+    with tasks_lock:
+        task = tasks.get(task_id)
+        task = dict(task) if task else None
+    if not task:
+        return jsonify({"error": "Unknown task"}), 404
+    task.pop("finished_at", None)
+    return jsonify({"task_id": task_id, **task}), 200
 
 if __name__ == "__main__":
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,9 @@
+import os
+
+# Task status, idempotency in-flight tracking and webhook waiters live in
+# process memory, so one worker process serves every request on many threads.
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = 1
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 16))
+timeout = 600
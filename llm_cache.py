@@ -0,0 +1,105 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+CACHE_PATH = os.environ.get('LLM_CACHE_PATH', 'llm_cache.sqlite3')
+CACHE_TTL_SECONDS = int(os.environ.get('LLM_CACHE_TTL', 86400))
+SEMANTIC_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.92))
+
+
+def _connect():
+    conn = sqlite3.connect(CACHE_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "key TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS semantic_responses ("
+        "id INTEGER PRIMARY KEY, context_key TEXT NOT NULL, embedding TEXT NOT NULL, "
+        "response TEXT NOT NULL, expires_at REAL NOT NULL)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS semantic_responses_context ON semantic_responses (context_key)"
+    )
+    return conn
+
+
+def _cosine_similarity(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def make_key(**inputs):
+    """Builds a stable SHA-256 cache key from JSON-serializable inputs."""
+    serialized = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def get(key):
+    """Returns the cached response for a key, or None on a miss or expiry."""
+    try:
+        with closing(_connect()) as conn:
+            row = conn.execute(
+                "SELECT response FROM responses WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        print(f"LLM cache lookup failed: {e}")
+        return None
+
+
+def put(key, response, ttl=CACHE_TTL_SECONDS):
+    """Stores a response under a key for ttl seconds."""
+    try:
+        with closing(_connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, expires_at) VALUES (?, ?, ?)",
+                (key, response, time.time() + ttl),
+            )
+    except sqlite3.Error as e:
+        print(f"LLM cache write failed: {e}")
+
+
+def find_similar(context_key, embedding, threshold=SEMANTIC_THRESHOLD):
+    """Returns the response whose embedding is nearest to the query, if similar enough.
+
+    Only entries stored under the same context_key are considered, so requests
+    whose exact-match context (e.g. checks) differs never share a response.
+    """
+    try:
+        with closing(_connect()) as conn:
+            rows = conn.execute(
+                "SELECT embedding, response FROM semantic_responses WHERE context_key = ? AND expires_at > ?",
+                (context_key, time.time()),
+            ).fetchall()
+    except sqlite3.Error as e:
+        print(f"Semantic cache lookup failed: {e}")
+        return None
+
+    best_score, best_response = 0.0, None
+    for stored_embedding, response in rows:
+        score = _cosine_similarity(embedding, json.loads(stored_embedding))
+        if score > best_score:
+            best_score, best_response = score, response
+    if best_score >= threshold:
+        print(f"Semantic cache hit with similarity {best_score:.3f}.")
+        return best_response
+    return None
+
+
+def put_similar(context_key, embedding, response, ttl=CACHE_TTL_SECONDS):
+    """Stores a response with its embedding for later similarity lookups."""
+    try:
+        with closing(_connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO semantic_responses (context_key, embedding, response, expires_at) VALUES (?, ?, ?, ?)",
+                (context_key, json.dumps(embedding), response, time.time() + ttl),
+            )
+    except sqlite3.Error as e:
+        print(f"Semantic cache write failed: {e}")
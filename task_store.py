@@ -0,0 +1,64 @@
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+STORE_PATH = os.environ.get('TASK_STORE_PATH', 'task_store.sqlite3')
+RESULT_TTL_SECONDS = int(os.environ.get('TASK_RESULT_TTL', 7 * 86400))
+
+
+def _connect():
+    conn = sqlite3.connect(STORE_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS results ("
+        "key TEXT PRIMARY KEY, payload TEXT NOT NULL, expires_at REAL NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS notify_dlq ("
+        "id INTEGER PRIMARY KEY, evaluation_url TEXT, payload TEXT NOT NULL, failed_at REAL NOT NULL)"
+    )
+    return conn
+
+
+def idempotency_key(data):
+    """Builds the key identifying repeated submissions of the same task round."""
+    return f"idem:{data.get('task')}:{data.get('round')}:{data.get('nonce')}"
+
+
+def get_result(key):
+    """Returns the stored notification payload for a key, or None if not completed."""
+    try:
+        with closing(_connect()) as conn:
+            row = conn.execute(
+                "SELECT payload FROM results WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+    except sqlite3.Error as e:
+        print(f"Task store lookup failed: {e}")
+        return None
+
+
+def save_result(key, payload, ttl=RESULT_TTL_SECONDS):
+    """Stores the notification payload of a completed task."""
+    try:
+        with closing(_connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, payload, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(payload), time.time() + ttl),
+            )
+    except sqlite3.Error as e:
+        print(f"Task store write failed: {e}")
+
+
+def add_dead_letter(evaluation_url, payload):
+    """Records a notification that could not be delivered so it can be replayed later."""
+    try:
+        with closing(_connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO notify_dlq (evaluation_url, payload, failed_at) VALUES (?, ?, ?)",
+                (evaluation_url, json.dumps(payload), time.time()),
+            )
+    except sqlite3.Error as e:
+        print(f"Failed to record undelivered notification: {e}")